@@ -44,6 +44,11 @@
   var model = null;
   var labels = [];
   var modelReady = false;
+  // 入力形式 (model.json の userDefinedMetadata.input)
+  //   gray01: 反転・正規化済みグレースケール [1, 28, 28, 1]
+  //   rgb255: 正規化は conv2d_1 に畳み込み済み、白枠付き生RGB [1, 30, 30, 3]
+  var inputFormat = 'gray01';
+  var inputPad = 0;
 
   // ============================================
   // DOM参照
@@ -106,7 +111,21 @@
       if (!res.ok) throw new Error('labels.json not found');
       labels = await res.json();
 
-      model = await tf.loadLayersModel(MODEL_PATH);
+      // model.json と weights.bin を一度だけ取得し、形式に応じてロード
+      var artifacts = await tf.io.http(MODEL_PATH).load();
+      var meta = artifacts.userDefinedMetadata || {};
+      if (meta.input) {
+        inputFormat = meta.input.format;
+        inputPad = meta.input.pad;
+      }
+      tmpCanvas.width = IMG_SIZE + inputPad * 2;
+      tmpCanvas.height = IMG_SIZE + inputPad * 2;
+
+      if (artifacts.format === 'graph-model') {
+        model = await tf.loadGraphModel(tf.io.fromMemory(artifacts));
+      } else {
+        model = await tf.loadLayersModel(tf.io.fromMemory(artifacts));
+      }
       modelReady = true;
 
       elModelStatus.textContent = 'AI準備完了！ (' + labels.length + 'カテゴリ認識)';
@@ -173,7 +192,7 @@
   }
 
   // ============================================
-  // Canvas → CNN テンソル変換 (入力: [1, 28, 28, 1])
+  // Canvas → CNN テンソル変換 (入力: [1, 28, 28, 1] or [1, 30, 30, 3])
   // バウンディングボックス検出 → 中央揃え → 28x28
   // ============================================
   var tmpCanvas = document.createElement('canvas');
@@ -206,6 +225,9 @@
 
     // 何も描かれていなければ空テンソル
     if (!found) {
+      if (inputFormat === 'rgb255') {
+        return tf.fill([1, tmpCanvas.height, tmpCanvas.width, 3], 255);
+      }
       return tf.zeros([1, IMG_SIZE, IMG_SIZE, 1]);
     }
 
@@ -222,10 +244,17 @@
     var cropX = cx - side / 2;
     var cropY = cy - side / 2;
 
-    // 切り出して28x28にリサイズ
+    // 切り出して28x28にリサイズ (rgb255 の場合は周囲に白枠)
     tmpCtx.fillStyle = '#fff';
-    tmpCtx.fillRect(0, 0, IMG_SIZE, IMG_SIZE);
-    tmpCtx.drawImage(drawCanvas, cropX, cropY, side, side, 0, 0, IMG_SIZE, IMG_SIZE);
+    tmpCtx.fillRect(0, 0, tmpCanvas.width, tmpCanvas.height);
+    tmpCtx.drawImage(drawCanvas, cropX, cropY, side, side, inputPad, inputPad, IMG_SIZE, IMG_SIZE);
+
+    // グレースケール化・反転・正規化はモデル側で行うのでピクセルをそのまま渡す
+    if (inputFormat === 'rgb255') {
+      return tf.tidy(function () {
+        return tf.browser.fromPixels(tmpCanvas, 3).toFloat().expandDims(0);
+      });
+    }
 
     var imgData = tmpCtx.getImageData(0, 0, IMG_SIZE, IMG_SIZE);
     var pixels = imgData.data;
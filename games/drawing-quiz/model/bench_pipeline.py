@@ -0,0 +1,341 @@
+"""
+Quick Draw 学習パイプライン ベンチマーク
+
+合成した Quick Draw 風 .npy (28x28 のストローク画像) を使い、
+train_cnn.py / train_sklearn.py の各ステージ
+(load, augment, train_epoch, eval, export) の所要時間を計測する。
+データのダウンロードが不要なので CI でも回帰を検出できる。
+
+使い方:
+  cd games/drawing-quiz/model
+  python bench_pipeline.py                   # ベースラインと比較 (遅くなったら exit 1)
+  python bench_pipeline.py --save-baseline   # ベースラインを記録し直す
+
+ベースライン (bench_baseline.json) がない場合は、今回の結果をベースラインとして
+保存して exit 0 で終わる。初回実行 (CI の基準マシン) で作られたファイルを
+コミットすれば、以降の実行で回帰を検出できる。
+
+  --pipelines sklearn   torch なしで sklearn 側だけ計測
+  --threshold 0.25      ベースラインより 25% 以上遅いステージを回帰とみなす
+
+train_sklearn.py はデータ拡張をしないので sklearn 側に augment ステージはない。
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import warnings
+from pathlib import Path
+from contextlib import contextmanager
+import numpy as np
+
+from train_sklearn import CATEGORIES, IMG_SIZE
+
+BASE_DIR = Path(__file__).parent
+BASELINE_PATH = BASE_DIR / "bench_baseline.json"
+
+BENCH_SAMPLES_PER_CLASS = 300
+BENCH_SEED = 0
+BENCH_REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+# これより短い差はタイマーの揺らぎとして無視する
+MIN_REGRESSION_SECONDS = 0.05
+
+STROKES_PER_CLASS = (3, 6)
+POINTS_PER_STROKE = 4
+STROKE_STEPS = 16
+PIPELINES = ("cnn", "sklearn")
+
+
+# ============================================
+# 合成データ
+# ============================================
+def draw_strokes(points):
+    """折れ線 [N, S, P, 2] (x, y) を 2px 幅で描いた uint8 画像 [N, 784] を返す"""
+    n = len(points)
+    t = np.linspace(0, 1, STROKE_STEPS)[:, None]
+    start = points[:, :, :-1, None, :]
+    end = points[:, :, 1:, None, :]
+    pts = start + (end - start) * t  # [N, S, P-1, T, 2]
+    pts = np.clip(np.rint(pts), 0, IMG_SIZE - 1).astype(np.int64).reshape(n, -1, 2)
+
+    images = np.zeros((n, IMG_SIZE * IMG_SIZE), dtype=np.uint8)
+    np.put_along_axis(images, pts[..., 1] * IMG_SIZE + pts[..., 0], 255, axis=1)
+
+    # Quick Draw のストロークに合わせて右・下に 1px 太らせる
+    images = images.reshape(n, IMG_SIZE, IMG_SIZE)
+    thick = images.copy()
+    thick[:, :, 1:] = np.maximum(thick[:, :, 1:], images[:, :, :-1])
+    thick[:, 1:, :] = np.maximum(thick[:, 1:, :], images[:, :-1, :])
+    return thick.reshape(n, -1)
+
+
+def generate_synthetic_data(data_dir, samples_per_class, seed=BENCH_SEED):
+    """
+    CATEGORIES ごとに <category>.npy を生成する。
+    クラスごとに固定のストロークのテンプレートを作り、サンプルごとに
+    頂点の揺らぎと平行移動を加える (同じ seed なら同じファイルになる)。
+    """
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    for i, cat in enumerate(CATEGORIES):
+        rng = np.random.default_rng([seed, i])
+        n_strokes = rng.integers(*STROKES_PER_CLASS)
+        template = rng.uniform(4, IMG_SIZE - 4, (n_strokes, POINTS_PER_STROKE, 2))
+
+        jitter = rng.normal(0, 1.5, (samples_per_class, n_strokes, POINTS_PER_STROKE, 2))
+        shift = rng.integers(-2, 3, (samples_per_class, 1, 1, 2))
+        images = draw_strokes(template[None] + jitter + shift)
+
+        np.save(data_dir / (cat["en"].replace(" ", "_") + ".npy"), images)
+
+
+# ============================================
+# ステージ計測
+# ============================================
+@contextmanager
+def timed(results, stage):
+    start = time.perf_counter()
+    yield
+    results[stage] = time.perf_counter() - start
+
+
+def bench_cnn(data_dir, out_dir, samples_per_class, seed):
+    """train_cnn.py の各ステージを再現モードで 1 回ずつ計測する"""
+    import torch.nn as nn
+    import torch.optim as optim
+    from sklearn.model_selection import train_test_split
+    import train_cnn as cnn
+
+    cnn.enable_reproducibility(seed)
+    results = {}
+
+    with timed(results, "load"):
+        X, y = cnn.load_dataset(samples_per_class, data_dir, verbose=False)
+    X_train, X_val, y_train, y_val = train_test_split(
+        X, y, test_size=0.1, random_state=42, stratify=y
+    )
+
+    with timed(results, "augment"):
+        X_train_aug = cnn.augment_batch(X_train, rng=np.random.default_rng(seed))
+    X_train = np.concatenate([X_train, X_train_aug])
+    y_train = np.concatenate([y_train, y_train])
+
+    train_loader, val_loader = cnn.build_loaders(X_train, y_train, X_val, y_val, seed=seed)
+    model = cnn.QuickDrawCNN(cnn.NUM_CLASSES)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=cnn.LR)
+
+    with timed(results, "train_epoch"):
+        cnn.train_one_epoch(model, train_loader, criterion, optimizer)
+
+    with timed(results, "eval"):
+        cnn.evaluate(model, val_loader, criterion)
+
+    with timed(results, "export"):
+        weight_data, weight_specs = cnn.pytorch_to_tfjs_weights(model, fold_input=True)
+        model_json = cnn.build_tfjs_model_json(weight_specs, fold_input=True)
+        cnn.verify_tfjs_parity(model, model_json, weight_data, X_val)
+        with open(Path(out_dir) / "model.json", "w") as f:
+            json.dump(model_json, f)
+        with open(Path(out_dir) / "weights.bin", "wb") as f:
+            f.write(weight_data)
+
+    return results
+
+
+def bench_sklearn(data_dir, out_dir, samples_per_class, seed):
+    """train_sklearn.py の各ステージを 1 回ずつ計測する (学習は 1 エポック)"""
+    from sklearn.exceptions import ConvergenceWarning
+    from sklearn.model_selection import train_test_split
+    import train_sklearn as skl
+
+    results = {}
+
+    with timed(results, "load"):
+        X, y = skl.load_dataset(samples_per_class, data_dir, verbose=False)
+    X_train, X_val, y_train, y_val = train_test_split(
+        X, y, test_size=0.1, random_state=42, stratify=y
+    )
+
+    mlp = skl.build_mlp(max_iter=1, verbose=False)
+    mlp.set_params(random_state=seed)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        with timed(results, "train_epoch"):
+            mlp.fit(X_train, y_train)
+
+    with timed(results, "eval"):
+        mlp.score(X_val, y_val)
+
+    with timed(results, "export"):
+        weight_data, weight_specs = skl.sklearn_to_tfjs_weights(mlp)
+        model_json = skl.build_tfjs_model_json(weight_specs)
+        with open(Path(out_dir) / "model.json", "w") as f:
+            json.dump(model_json, f)
+        with open(Path(out_dir) / "weights.bin", "wb") as f:
+            f.write(weight_data)
+
+    return results
+
+
+BENCHES = {"cnn": bench_cnn, "sklearn": bench_sklearn}
+
+
+def run_benchmarks(pipelines, data_dir, samples_per_class, seed, repeat):
+    """各パイプラインを repeat 回実行し、ステージごとの最小時間 (秒) を返す"""
+    timings = {}
+    for name in pipelines:
+        runs = []
+        for r in range(repeat):
+            with tempfile.TemporaryDirectory() as out_dir:
+                runs.append(BENCHES[name](data_dir, out_dir, samples_per_class, seed))
+            print(f"  {name} run {r+1}/{repeat}: "
+                  + ", ".join(f"{k}={v:.3f}s" for k, v in runs[-1].items()))
+        timings[name] = {stage: round(min(run[stage] for run in runs), 4) for stage in runs[0]}
+    return timings
+
+
+def environment_info(pipelines):
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+    }
+    if "cnn" in pipelines:
+        import torch
+        info["torch"] = torch.__version__
+        info["torchThreads"] = torch.get_num_threads()
+    if "sklearn" in pipelines:
+        import sklearn
+        info["sklearn"] = sklearn.__version__
+    return info
+
+
+# ============================================
+# ベースライン比較
+# ============================================
+def compare_to_baseline(current, baseline, threshold):
+    """
+    ベースラインと比較し (回帰したステージ, 計測されなかったステージ) を返す。
+    ベースラインにあって今回計測されなかったステージも失敗として扱う。
+    """
+    regressions = []
+    missing = []
+    print(f"\n{'stage':<22}{'baseline':>10}{'current':>10}{'ratio':>8}")
+    for name, base_stages in baseline["timings"].items():
+        for stage, base in base_stages.items():
+            if stage not in current["timings"].get(name, {}):
+                print(f"{name + '/' + stage:<22}{base:>10.3f}{'-':>10}{'missing':>8}")
+                missing.append((name, stage))
+    for name, stages in current["timings"].items():
+        base_stages = baseline["timings"].get(name, {})
+        for stage, seconds in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                print(f"{name + '/' + stage:<22}{'-':>10}{seconds:>10.3f}{'new':>8}")
+                continue
+            ratio = seconds / base if base > 0 else float("inf")
+            slower = seconds > base * (1 + threshold) and seconds - base > MIN_REGRESSION_SECONDS
+            mark = "  ← 回帰" if slower else ""
+            print(f"{name + '/' + stage:<22}{base:>10.3f}{seconds:>10.3f}{ratio:>8.2f}{mark}")
+            if slower:
+                regressions.append((name, stage, base, seconds))
+    return regressions, missing
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Quick Draw 学習パイプライン ベンチマーク")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES),
+                        help="計測するパイプライン")
+    parser.add_argument("--samples-per-class", type=int, default=BENCH_SAMPLES_PER_CLASS,
+                        help="合成データのサンプル数/クラス")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED,
+                        help="合成データ・学習の乱数シード")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT,
+                        help="繰り返し回数 (ステージごとに最小値を採用)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="回帰とみなす遅延の割合 (0.25 = 25%%)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH,
+                        help="ベースライン JSON のパス")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="比較せずに今回の結果をベースラインとして保存する")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="今回の結果を JSON で保存するパス")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = {
+        "pipelines": sorted(args.pipelines),
+        "samplesPerClass": args.samples_per_class,
+        "numClasses": len(CATEGORIES),
+        "seed": args.seed,
+    }
+
+    baseline = None
+    if not args.save_baseline and args.baseline.exists():
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # 設定が違うと比較できないので計測前に打ち切る
+        if baseline["config"] != config:
+            print(f"\nベンチマーク設定がベースラインと異なるため比較できません")
+            print(f"  baseline: {baseline['config']}")
+            print(f"  current:  {config}")
+            print(f"(設定を変えた場合は --save-baseline で記録し直してください)\n")
+            return 1
+
+    print(f"\n=== 学習パイプライン ベンチマーク ===")
+    print(f"パイプライン: {', '.join(config['pipelines'])}")
+    print(f"合成データ: {args.samples_per_class} samples x {len(CATEGORIES)} クラス\n")
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_synthetic_data(data_dir, args.samples_per_class, args.seed)
+        timings = run_benchmarks(
+            config["pipelines"], data_dir, args.samples_per_class, args.seed, args.repeat
+        )
+
+    current = {
+        "config": config,
+        "environment": environment_info(config["pipelines"]),
+        "timings": timings,
+    }
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\n  → {args.output}")
+
+    if args.save_baseline or baseline is None:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        if baseline is None and not args.save_baseline:
+            print(f"\nベースラインがないため今回の結果を記録しました (比較はしていません)")
+        print(f"\n  → ベースライン保存: {args.baseline}")
+        return 0
+
+    if baseline["environment"] != current["environment"]:
+        print("\n注意: 実行環境がベースライン記録時と異なります")
+
+    regressions, missing = compare_to_baseline(current, baseline, args.threshold)
+    if regressions or missing:
+        if regressions:
+            print(f"\n{len(regressions)} ステージが {args.threshold:.0%} 以上遅くなりました")
+        if missing:
+            print(f"\n{len(missing)} ステージが計測されませんでした: "
+                  + ", ".join(f"{name}/{stage}" for name, stage in missing))
+        print(f"\n=== 失敗 ===\n")
+        return 1
+
+    print(f"\n=== OK ===\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
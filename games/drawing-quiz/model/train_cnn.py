@@ -7,10 +7,22 @@ PyTorch の CNN で学習し、TF.js 互換の model.json + weights.bin を出
   cd games/drawing-quiz/model
   pip install torch torchvision --index-url https://download.pytorch.org/whl/cpu
   python train_cnn.py
+
+オプション:
+  --no-fold      入力正規化・反転を conv2d_1 に畳み込まない (従来の 28x28x1 入力)
+  --graph-model  layers-model の代わりに TF.js graph-model を出力する
+  --seed N       再現モード: NumPy / torch / DataLoader を N で固定し決定的カーネルを使う
+                 (同じ N なら weights.bin がバイト単位で一致する)
+  --workers N    DataLoader のワーカー数
 """
 
 import os
 import json
+import time
+import random
+import hashlib
+import argparse
+import base64
 import numpy as np
 from pathlib import Path
 import torch
@@ -68,6 +80,14 @@ BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 OUT_DIR = BASE_DIR / "tfjs"
 
+# 正規化畳み込み時の入力: 白 (255) で 1px 枠付けした 30x30 RGB 生ピクセル
+FOLD_PAD = 1
+FOLD_IMG_SIZE = IMG_SIZE + FOLD_PAD * 2
+FOLD_CHANNELS = 3
+PARITY_TOL = 1e-4
+DETERMINISM_BENCH_BATCHES = 20
+DETERMINISM_BENCH_ROUNDS = 3
+
 
 # ============================================
 # CNN モデル定義
@@ -100,9 +120,9 @@ class QuickDrawCNN(nn.Module):
 # ============================================
 # データ読み込み
 # ============================================
-def load_npy(category_en, max_samples):
+def load_npy(category_en, max_samples, data_dir=DATA_DIR):
     filename = category_en.replace(" ", "_") + ".npy"
-    filepath = DATA_DIR / filename
+    filepath = Path(data_dir) / filename
     if not filepath.exists():
         raise FileNotFoundError(
             f"{filepath} が見つかりません。先にデータをダウンロードしてください。"
@@ -111,35 +131,219 @@ def load_npy(category_en, max_samples):
     return data[:max_samples]
 
 
+def load_dataset(max_samples, data_dir=DATA_DIR, verbose=True):
+    """全カテゴリを読み込み、正規化済み画像 X [N, 784] とラベル y を返す"""
+    all_images = []
+    all_labels = []
+
+    for i, cat in enumerate(CATEGORIES):
+        data = load_npy(cat["en"], max_samples, data_dir)
+        n = len(data)
+        all_images.append(data)
+        all_labels.extend([i] * n)
+        if verbose:
+            print(f"  {cat['ja']} ({cat['en']}): {n} samples")
+
+    X = np.vstack(all_images).astype(np.float32) / 255.0
+    y = np.array(all_labels, dtype=np.int64)
+    return X, y
+
+
+def build_loaders(X_train, y_train, X_val, y_val, seed=None, workers=0):
+    """
+    学習・検証用 DataLoader を作る。
+    学習側はデータ順のフィンガープリント用にサンプルのインデックスも流す。
+    """
+    X_train_t = torch.tensor(X_train.reshape(-1, 1, IMG_SIZE, IMG_SIZE))
+    y_train_t = torch.tensor(y_train)
+    X_val_t = torch.tensor(X_val.reshape(-1, 1, IMG_SIZE, IMG_SIZE))
+    y_val_t = torch.tensor(y_val)
+
+    train_ds = TensorDataset(X_train_t, y_train_t, torch.arange(len(X_train_t)))
+    val_ds = TensorDataset(X_val_t, y_val_t)
+    train_loader = DataLoader(
+        train_ds, batch_size=BATCH_SIZE, shuffle=True,
+        num_workers=workers,
+        worker_init_fn=seed_worker if seed is not None else None,
+        generator=make_loader_generator(seed),
+    )
+    val_loader = DataLoader(val_ds, batch_size=BATCH_SIZE, num_workers=workers)
+    return train_loader, val_loader
+
+
+# ============================================
+# 学習・評価ループ
+# ============================================
+def train_one_epoch(model, loader, criterion, optimizer, data_order=None):
+    """1 エポック学習し (loss 合計, 正解数, サンプル数) を返す"""
+    model.train()
+    total_loss = 0
+    correct = 0
+    total = 0
+
+    for batch_x, batch_y, batch_idx in loader:
+        if data_order is not None:
+            data_order.update(batch_idx.numpy().astype("<i8").tobytes())
+        optimizer.zero_grad()
+        out = model(batch_x)
+        loss = criterion(out, batch_y)
+        loss.backward()
+        optimizer.step()
+
+        total_loss += loss.item() * len(batch_x)
+        correct += (out.argmax(1) == batch_y).sum().item()
+        total += len(batch_x)
+
+    return total_loss, correct, total
+
+
+def evaluate(model, loader, criterion):
+    """検証データで評価し (loss 合計, 正解数, サンプル数) を返す"""
+    model.eval()
+    total_loss = 0
+    correct = 0
+    total = 0
+    with torch.no_grad():
+        for batch_x, batch_y in loader:
+            out = model(batch_x)
+            loss = criterion(out, batch_y)
+            total_loss += loss.item() * len(batch_x)
+            correct += (out.argmax(1) == batch_y).sum().item()
+            total += len(batch_x)
+
+    return total_loss, correct, total
+
+
 # ============================================
 # データ拡張 (numpy)
 # ============================================
-def augment_batch(images):
-    """ランダムなノイズ・シフトでデータ拡張"""
+def augment_batch(images, rng=None):
+    """ランダムなノイズ・シフトでデータ拡張 (rng を渡すと再現可能)"""
+    if rng is None:
+        rng = np.random.default_rng()
     augmented = images.copy()
     n = len(augmented)
 
     # ランダムノイズ (20%の確率)
-    mask = np.random.random(n) < 0.2
-    noise = np.random.normal(0, 0.05, augmented[mask].shape).astype(np.float32)
+    mask = rng.random(n) < 0.2
+    noise = rng.normal(0, 0.05, augmented[mask].shape).astype(np.float32)
     augmented[mask] = np.clip(augmented[mask] + noise, 0, 1)
 
     # ランダムシフト (30%の確率, 1-2ピクセル)
     for i in range(n):
-        if np.random.random() < 0.3:
-            dx = np.random.randint(-2, 3)
-            dy = np.random.randint(-2, 3)
+        if rng.random() < 0.3:
+            dx = rng.integers(-2, 3)
+            dy = rng.integers(-2, 3)
             img = augmented[i].reshape(IMG_SIZE, IMG_SIZE)
             augmented[i] = np.roll(np.roll(img, dx, axis=1), dy, axis=0).flatten()
 
     return augmented
 
 
+# ============================================
+# 再現モード
+# ============================================
+def enable_reproducibility(seed):
+    """Python / NumPy / torch の乱数を固定し、決定的カーネルを強制する"""
+    # CUDA の cuBLAS を決定的にするには torch の初期化前に設定が必要
+    os.environ.setdefault("CUBLAS_WORKSPACE_CONFIG", ":4096:8")
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    torch.use_deterministic_algorithms(True)
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+
+
+def seed_worker(worker_id):
+    """DataLoader ワーカーごとの乱数を loader の generator から派生させる"""
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+def make_loader_generator(seed):
+    """シャッフル順を決める DataLoader 専用の generator (None なら非固定)"""
+    if seed is None:
+        return None
+    g = torch.Generator()
+    g.manual_seed(seed)
+    return g
+
+
+def measure_train_throughput(X, y, deterministic, seed, n_batches=DETERMINISM_BENCH_BATCHES):
+    """新しいモデルで n_batches ステップ学習し、samples/sec を返す"""
+    torch.use_deterministic_algorithms(deterministic)
+    torch.backends.cudnn.deterministic = deterministic
+    torch.manual_seed(seed)
+    model = QuickDrawCNN(NUM_CLASSES)
+    model.train()
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=LR)
+
+    n = min(len(X), BATCH_SIZE * n_batches)
+    batches = torch.split(torch.arange(n), BATCH_SIZE)
+    start = time.perf_counter()
+    for idx in batches:
+        optimizer.zero_grad()
+        loss = criterion(model(X[idx]), y[idx])
+        loss.backward()
+        optimizer.step()
+    return n / (time.perf_counter() - start)
+
+
+def measure_determinism_cost(X, y, seed, rounds=DETERMINISM_BENCH_ROUNDS):
+    """
+    決定的カーネルの有無で学習スループットを比較する。
+
+    スレッドプール起動・アロケータの拡張・oneDNN プリミティブ生成などの
+    初回コストが片方だけに乗らないよう、計測しないウォームアップを先に回し、
+    その後は両モードを交互に rounds 回ずつ計測して最良値を採用する。
+    """
+    measure_train_throughput(X, y, deterministic=False, seed=seed)
+    measure_train_throughput(X, y, deterministic=True, seed=seed)
+
+    fast = 0.0
+    strict = 0.0
+    for _ in range(rounds):
+        fast = max(fast, measure_train_throughput(X, y, deterministic=False, seed=seed))
+        strict = max(strict, measure_train_throughput(X, y, deterministic=True, seed=seed))
+    # 計測で進んだ乱数を巻き戻す (決定的カーネルは最後の計測で有効のまま)
+    torch.manual_seed(seed)
+    return {
+        "nondeterministicSamplesPerSec": round(fast, 1),
+        "deterministicSamplesPerSec": round(strict, 1),
+        "slowdown": round(fast / strict, 3),
+    }
+
+
 # ============================================
 # PyTorch → TF.js 変換
 # ============================================
-def build_tfjs_model_json(weight_specs):
+def tfjs_input_metadata(fold_input, training_info=None):
+    """
+    model.json の userDefinedMetadata。
+    input は game.js が前処理を切り替えるため、training は再現性の記録用。
+    training には実行ごとに変わらない値 (seed・ハッシュ) だけを入れる。
+    """
+    if not fold_input:
+        metadata = {"input": {"format": "gray01", "size": IMG_SIZE, "pad": 0}}
+    else:
+        metadata = {"input": {"format": "rgb255", "size": FOLD_IMG_SIZE, "pad": FOLD_PAD}}
+    if training_info is not None:
+        metadata["training"] = training_info
+    return metadata
+
+
+def build_tfjs_model_json(weight_specs, fold_input=False, training_info=None):
     """TF.js layers-model 形式の model.json (CNN版)"""
+    if fold_input:
+        input_shape = [None, FOLD_IMG_SIZE, FOLD_IMG_SIZE, FOLD_CHANNELS]
+        conv1_padding = "valid"
+    else:
+        input_shape = [None, IMG_SIZE, IMG_SIZE, 1]
+        conv1_padding = "same"
+
     model_config = {
         "class_name": "Sequential",
         "config": {
@@ -151,7 +355,7 @@ def build_tfjs_model_json(weight_specs):
                         "filters": 32,
                         "kernel_size": [3, 3],
                         "strides": [1, 1],
-                        "padding": "same",
+                        "padding": conv1_padding,
                         "data_format": "channels_last",
                         "dilation_rate": [1, 1],
                         "activation": "relu",
@@ -160,7 +364,7 @@ def build_tfjs_model_json(weight_specs):
                         "bias_initializer": {"class_name": "Zeros", "config": {}},
                         "name": "conv2d_1",
                         "dtype": "float32",
-                        "batch_input_shape": [None, IMG_SIZE, IMG_SIZE, 1],
+                        "batch_input_shape": input_shape,
                     },
                 },
                 {
@@ -245,15 +449,147 @@ def build_tfjs_model_json(weight_specs):
         "format": "layers-model",
         "generatedBy": "train_cnn.py",
         "convertedBy": None,
+        "userDefinedMetadata": tfjs_input_metadata(fold_input, training_info),
     }
 
 
-def pytorch_to_tfjs_weights(model):
-    """PyTorch CNN の重みを TF.js 形式に変換"""
-    weight_data = bytearray()
-    weight_specs = []
+def _attr_s(value):
+    """graph-model の文字列属性 (proto JSON では base64)"""
+    return base64.b64encode(value.encode("ascii")).decode("ascii")
+
+
+def _attr_ints(values):
+    return {"list": {"i": [str(v) for v in values]}}
+
+
+def _const_node(spec):
+    dtype = {"float32": "DT_FLOAT", "int32": "DT_INT32"}[spec["dtype"]]
+    return {
+        "name": spec["name"],
+        "op": "Const",
+        "attr": {
+            "value": {"tensor": {
+                "dtype": dtype,
+                "tensorShape": {"dim": [{"size": str(d)} for d in spec["shape"]]},
+            }},
+            "dtype": {"type": dtype},
+        },
+    }
+
+
+def _fused_conv_node(name, src, padding):
+    return {
+        "name": name,
+        "op": "_FusedConv2D",
+        "input": [src, f"{name}/kernel", f"{name}/bias"],
+        "attr": {
+            "T": {"type": "DT_FLOAT"},
+            "strides": _attr_ints([1, 1, 1, 1]),
+            "dilations": _attr_ints([1, 1, 1, 1]),
+            "padding": {"s": _attr_s(padding)},
+            "data_format": {"s": _attr_s("NHWC")},
+            "explicit_paddings": {"list": {}},
+            "use_cudnn_on_gpu": {"b": True},
+            "num_args": {"i": "1"},
+            "epsilon": {"f": 0.0},
+            "fused_ops": {"list": {"s": [_attr_s("BiasAdd"), _attr_s("Relu")]}},
+        },
+    }
+
+
+def _max_pool_node(name, src):
+    return {
+        "name": name,
+        "op": "MaxPool",
+        "input": [src],
+        "attr": {
+            "T": {"type": "DT_FLOAT"},
+            "ksize": _attr_ints([1, 2, 2, 1]),
+            "strides": _attr_ints([1, 2, 2, 1]),
+            "padding": {"s": _attr_s("VALID")},
+            "data_format": {"s": _attr_s("NHWC")},
+        },
+    }
+
+
+def _fused_matmul_node(name, src, fused_ops):
+    return {
+        "name": name,
+        "op": "_FusedMatMul",
+        "input": [src, f"{name}/kernel", f"{name}/bias"],
+        "attr": {
+            "T": {"type": "DT_FLOAT"},
+            "transpose_a": {"b": False},
+            "transpose_b": {"b": False},
+            "num_args": {"i": "1"},
+            "epsilon": {"f": 0.0},
+            "fused_ops": {"list": {"s": [_attr_s(op) for op in fused_ops]}},
+        },
+    }
+
+
+def build_tfjs_graph_model_json(weight_specs, fold_input=False, training_info=None):
+    """
+    TF.js graph-model 形式の model.json (CNN版)
+
+    Conv2D+BiasAdd+Relu と MatMul+BiasAdd(+Relu) を融合カーネル
+    (_FusedConv2D / _FusedMatMul) として出力する。
+    layers-model と違いレイヤー構築が不要なので読み込みが速い。
+    """
+    if fold_input:
+        size, channels, conv1_padding = FOLD_IMG_SIZE, FOLD_CHANNELS, "VALID"
+    else:
+        size, channels, conv1_padding = IMG_SIZE, 1, "SAME"
+
+    nodes = [{
+        "name": "input",
+        "op": "Placeholder",
+        "attr": {
+            "dtype": {"type": "DT_FLOAT"},
+            "shape": {"shape": {"dim": [{"size": str(d)} for d in [-1, size, size, channels]]}},
+        },
+    }]
+    nodes.extend(_const_node(spec) for spec in weight_specs)
+    nodes.extend([
+        _fused_conv_node("conv2d_1", "input", conv1_padding),
+        _max_pool_node("max_pooling2d_1", "conv2d_1"),
+        _fused_conv_node("conv2d_2", "max_pooling2d_1", "SAME"),
+        _max_pool_node("max_pooling2d_2", "conv2d_2"),
+        {
+            "name": "flatten_1",
+            "op": "Reshape",
+            "input": ["max_pooling2d_2", "flatten_1/shape"],
+            "attr": {"T": {"type": "DT_FLOAT"}, "Tshape": {"type": "DT_INT32"}},
+        },
+        _fused_matmul_node("dense_1", "flatten_1", ["BiasAdd", "Relu"]),
+        _fused_matmul_node("dense_2", "dense_1", ["BiasAdd"]),
+        {
+            "name": "output",
+            "op": "Softmax",
+            "input": ["dense_2"],
+            "attr": {"T": {"type": "DT_FLOAT"}},
+        },
+    ])
+
+    return {
+        "modelTopology": {"node": nodes, "library": {}, "versions": {}},
+        "weightsManifest": [
+            {
+                "paths": ["weights.bin"],
+                "weights": weight_specs,
+            }
+        ],
+        "format": "graph-model",
+        "generatedBy": "train_cnn.py",
+        "convertedBy": None,
+        "userDefinedMetadata": tfjs_input_metadata(fold_input, training_info),
+    }
+
 
+def pytorch_to_tfjs_tensors(model):
+    """PyTorch CNN の重みを TF.js のレイアウトに並べ替えた (名前, ndarray) のリスト"""
     state = model.state_dict()
+    tensors = []
 
     # Conv2D 層: PyTorch [out, in, H, W] → TF.js [H, W, in, out]
     conv_layers = [
@@ -263,21 +599,9 @@ def pytorch_to_tfjs_weights(model):
     for pt_name, tfjs_name in conv_layers:
         kernel = state[f"{pt_name}.weight"].numpy()
         kernel = kernel.transpose(2, 3, 1, 0)  # [out,in,H,W] → [H,W,in,out]
-        kernel = kernel.astype(np.float32)
-        weight_data.extend(kernel.tobytes())
-        weight_specs.append({
-            "name": f"{tfjs_name}/kernel",
-            "shape": list(kernel.shape),
-            "dtype": "float32",
-        })
-
+        tensors.append((f"{tfjs_name}/kernel", kernel.astype(np.float32)))
         bias = state[f"{pt_name}.bias"].numpy().astype(np.float32)
-        weight_data.extend(bias.tobytes())
-        weight_specs.append({
-            "name": f"{tfjs_name}/bias",
-            "shape": list(bias.shape),
-            "dtype": "float32",
-        })
+        tensors.append((f"{tfjs_name}/bias", bias))
 
     # Dense 層: PyTorch [out, in] → TF.js [in, out]
     dense_layers = [
@@ -286,47 +610,300 @@ def pytorch_to_tfjs_weights(model):
     ]
     for pt_name, tfjs_name in dense_layers:
         kernel = state[f"{pt_name}.weight"].numpy()
+        if pt_name == "fc1":
+            # PyTorch は [C, H, W] 順、TF.js の Flatten は [H, W, C] 順で平坦化する
+            kernel = kernel.reshape(-1, 64, 7, 7).transpose(0, 2, 3, 1).reshape(kernel.shape[0], -1)
         kernel = kernel.T.astype(np.float32)  # [out, in] → [in, out]
-        weight_data.extend(kernel.tobytes())
-        weight_specs.append({
-            "name": f"{tfjs_name}/kernel",
-            "shape": list(kernel.shape),
-            "dtype": "float32",
-        })
-
+        tensors.append((f"{tfjs_name}/kernel", kernel))
         bias = state[f"{pt_name}.bias"].numpy().astype(np.float32)
-        weight_data.extend(bias.tobytes())
+        tensors.append((f"{tfjs_name}/bias", bias))
+
+    return tensors
+
+
+def fold_input_normalization(tensors):
+    """
+    game.js の前処理 x = (255 - (r + g + b) / 3) / 255 を conv2d_1 に畳み込む。
+
+    W·x + b = W·1 - (W / 765)·(r + g + b) + b なので
+    kernel' = -kernel / 765 (RGB 3ch に複製), bias' = bias + Σkernel。
+    "same" のゼロパディングは x = 0 (白) に相当するため、
+    入力側で白 1px 枠を付けて "valid" 畳み込みにすれば境界も厳密に一致する。
+    """
+    folded = []
+    for name, arr in tensors:
+        if name == "conv2d_1/kernel":
+            kernel = arr.astype(np.float64)
+            arr = np.repeat(-kernel / (255.0 * FOLD_CHANNELS), FOLD_CHANNELS, axis=2)
+            bias_offset = kernel.sum(axis=(0, 1, 2))
+        elif name == "conv2d_1/bias":
+            arr = arr.astype(np.float64) + bias_offset
+        folded.append((name, arr.astype(np.float32)))
+    return folded
+
+
+def pack_tfjs_weights(tensors):
+    """(名前, ndarray) のリストを weights.bin のバイト列と weightsManifest に変換"""
+    weight_data = bytearray()
+    weight_specs = []
+    for name, arr in tensors:
+        weight_data.extend(arr.tobytes())
         weight_specs.append({
-            "name": f"{tfjs_name}/bias",
-            "shape": list(bias.shape),
-            "dtype": "float32",
+            "name": name,
+            "shape": list(arr.shape),
+            "dtype": str(arr.dtype),
         })
-
     return bytes(weight_data), weight_specs
 
 
+def pytorch_to_tfjs_weights(model, fold_input=False, graph_model=False):
+    """PyTorch CNN の重みを TF.js 形式に変換"""
+    tensors = pytorch_to_tfjs_tensors(model)
+    if fold_input:
+        tensors = fold_input_normalization(tensors)
+    if graph_model:
+        # Flatten は graph-model では Reshape(shape=[-1, 3136]) になる
+        tensors.append(("flatten_1/shape", np.array([-1, 64 * 7 * 7], dtype=np.int32)))
+    return pack_tfjs_weights(tensors)
+
+
+# ============================================
+# エクスポート検証 (PyTorch とのパリティ)
+# ============================================
+def unpack_tfjs_weights(weight_data, weight_specs):
+    """weights.bin のバイト列を名前 → ndarray の dict に戻す"""
+    tensors = {}
+    offset = 0
+    for spec in weight_specs:
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        arr = np.frombuffer(weight_data, dtype=dtype, count=count, offset=offset)
+        tensors[spec["name"]] = arr.reshape(spec["shape"])
+        offset += count * dtype.itemsize
+    return tensors
+
+
+def browser_input(x, input_meta):
+    """正規化済み画像 [N, 784] を game.js がモデルに渡す形式に変換"""
+    images = x.reshape(-1, IMG_SIZE, IMG_SIZE, 1)
+    if input_meta["format"] == "gray01":
+        return images
+    if input_meta["format"] != "rgb255":
+        raise ValueError(f"未知の入力形式: {input_meta['format']}")
+    pad = input_meta["pad"]
+    raw = np.round(255.0 * (1.0 - images))
+    raw = np.pad(raw, ((0, 0), (pad, pad), (pad, pad), (0, 0)), constant_values=255.0)
+    return np.repeat(raw, FOLD_CHANNELS, axis=3).astype(np.float32)
+
+
+# numpy による TF.js モデルの解釈実行。
+# model.json の構造 (レイヤー / ノード) をそのまま辿るので、
+# 重みだけでなく出力したトポロジーの誤りもパリティ検証で検出できる。
+def _np_conv2d(x, kernel, padding):
+    kh, kw = kernel.shape[:2]
+    if padding == "same":
+        x = np.pad(x, ((0, 0), ((kh - 1) // 2, kh // 2), ((kw - 1) // 2, kw // 2), (0, 0)))
+    elif padding != "valid":
+        raise ValueError(f"未対応の padding: {padding}")
+    windows = np.lib.stride_tricks.sliding_window_view(x, (kh, kw), axis=(1, 2))
+    return np.einsum("nhwcij,ijco->nhwo", windows, kernel, optimize=True)
+
+
+def _np_max_pool(x, pool, strides, padding):
+    if list(pool) != list(strides) or padding != "valid":
+        raise ValueError(f"未対応の MaxPool: pool={pool} strides={strides} padding={padding}")
+    ph, pw = pool
+    n, h, w, c = x.shape
+    x = x[:, :h - h % ph, :w - w % pw]
+    return x.reshape(n, h // ph, ph, w // pw, pw, c).max(axis=(2, 4))
+
+
+def _np_activation(x, name):
+    if name == "linear":
+        return x
+    if name == "relu":
+        return np.maximum(x, 0)
+    if name == "softmax":
+        e = np.exp(x - x.max(axis=-1, keepdims=True))
+        return e / e.sum(axis=-1, keepdims=True)
+    raise ValueError(f"未対応の activation: {name}")
+
+
+def _check_input_shape(x, shape):
+    expected = [None if d is None or d == -1 else d for d in shape]
+    actual = [None] + list(x.shape[1:])
+    if len(expected) != len(actual) or any(
+        e is not None and e != a for e, a in zip(expected[1:], actual[1:])
+    ):
+        raise ValueError(f"入力形状が一致しません: model={shape}, input={list(x.shape)}")
+
+
+def run_tfjs_layers_model(model_json, tensors, x):
+    """layers-model の modelTopology.config.layers を順に実行する"""
+    for layer in model_json["modelTopology"]["config"]["layers"]:
+        cls, cfg = layer["class_name"], layer["config"]
+        if "batch_input_shape" in cfg:
+            _check_input_shape(x, cfg["batch_input_shape"])
+        if cls == "Conv2D":
+            if cfg["strides"] != [1, 1] or cfg["dilation_rate"] != [1, 1]:
+                raise ValueError(f"未対応の Conv2D 設定: {cfg['name']}")
+            x = _np_conv2d(x, tensors[f"{cfg['name']}/kernel"], cfg["padding"])
+            x = _np_activation(x + tensors[f"{cfg['name']}/bias"], cfg["activation"])
+        elif cls == "MaxPooling2D":
+            x = _np_max_pool(x, cfg["pool_size"], cfg["strides"], cfg["padding"])
+        elif cls == "Flatten":
+            x = x.reshape(len(x), -1)
+        elif cls == "Dense":
+            x = x @ tensors[f"{cfg['name']}/kernel"] + tensors[f"{cfg['name']}/bias"]
+            x = _np_activation(x, cfg["activation"])
+        else:
+            raise ValueError(f"未対応のレイヤー: {cls}")
+    return x
+
+
+def _decode_s(attr):
+    return base64.b64decode(attr["s"]).decode("ascii")
+
+
+def _attr_list_ints(attr):
+    return [int(v) for v in attr["list"].get("i", [])]
+
+
+def _fused_ops(attrs):
+    ops = [base64.b64decode(v).decode("ascii") for v in attrs["fused_ops"]["list"].get("s", [])]
+    if not ops or ops[0] != "BiasAdd" or int(attrs["num_args"]["i"]) != 1:
+        raise ValueError(f"未対応の fused_ops: {ops}")
+    if len(ops) == 1:
+        return "linear"
+    if ops[1:] == ["Relu"]:
+        return "relu"
+    raise ValueError(f"未対応の fused_ops: {ops}")
+
+
+def run_tfjs_graph_model(model_json, tensors, x):
+    """graph-model の modelTopology.node を op ごとに解釈し、input を辿って実行する"""
+    nodes = {node["name"]: node for node in model_json["modelTopology"]["node"]}
+    consumed = {name for node in nodes.values() for name in node.get("input", [])}
+    outputs = [name for name in nodes if name not in consumed]
+    if len(outputs) != 1:
+        raise ValueError(f"出力ノードが 1 つではありません: {outputs}")
+
+    values = {}
+
+    def evaluate_node(name):
+        if name in values:
+            return values[name]
+        if name not in nodes:
+            raise ValueError(f"存在しない入力ノード: {name}")
+        node = nodes[name]
+        op, attrs = node["op"], node.get("attr", {})
+        args = [evaluate_node(src) for src in node.get("input", [])]
+
+        if op == "Placeholder":
+            dims = [int(d["size"]) for d in attrs["shape"]["shape"]["dim"]]
+            _check_input_shape(x, dims)
+            out = x
+        elif op == "Const":
+            out = tensors[name]
+        elif op == "_FusedConv2D":
+            if (_attr_list_ints(attrs["strides"]) != [1, 1, 1, 1]
+                    or _attr_list_ints(attrs["dilations"]) != [1, 1, 1, 1]
+                    or _decode_s(attrs["data_format"]) != "NHWC"):
+                raise ValueError(f"未対応の Conv2D 設定: {name}")
+            inp, kernel, bias = args
+            out = _np_conv2d(inp, kernel, _decode_s(attrs["padding"]).lower()) + bias
+            out = _np_activation(out, _fused_ops(attrs))
+        elif op == "MaxPool":
+            ksize = _attr_list_ints(attrs["ksize"])
+            strides = _attr_list_ints(attrs["strides"])
+            out = _np_max_pool(args[0], ksize[1:3], strides[1:3], _decode_s(attrs["padding"]).lower())
+        elif op == "Reshape":
+            out = args[0].reshape([int(d) for d in args[1]])
+        elif op == "_FusedMatMul":
+            inp, kernel, bias = args
+            if attrs["transpose_a"]["b"]:
+                inp = inp.T
+            if attrs["transpose_b"]["b"]:
+                kernel = kernel.T
+            out = _np_activation(inp @ kernel + bias, _fused_ops(attrs))
+        elif op == "Softmax":
+            out = _np_activation(args[0], "softmax")
+        else:
+            raise ValueError(f"未対応の op: {op}")
+
+        values[name] = out
+        return out
+
+    return evaluate_node(outputs[0])
+
+
+def run_tfjs_model(model_json, tensors, x):
+    """model.json の format に応じて TF.js と同じ計算を numpy で行う"""
+    if model_json["format"] == "graph-model":
+        return run_tfjs_graph_model(model_json, tensors, x)
+    return run_tfjs_layers_model(model_json, tensors, x)
+
+
+def verify_tfjs_parity(model, model_json, weight_data, X_val):
+    """
+    検証データ全件で PyTorch とエクスポート結果の出力を比較する。
+    入力は userDefinedMetadata.input に従って game.js と同じ形に変換し、
+    model.json のトポロジーを解釈実行する。
+    """
+    weight_specs = model_json["weightsManifest"][0]["weights"]
+    tensors = unpack_tfjs_weights(weight_data, weight_specs)
+    input_meta = model_json["userDefinedMetadata"]["input"]
+    max_diff = 0.0
+    agree = 0
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(X_val), BATCH_SIZE):
+            xb = X_val[start:start + BATCH_SIZE]
+            expected = torch.softmax(
+                model(torch.tensor(xb.reshape(-1, 1, IMG_SIZE, IMG_SIZE))), dim=1
+            ).numpy()
+            actual = run_tfjs_model(model_json, tensors, browser_input(xb, input_meta))
+            max_diff = max(max_diff, float(np.abs(actual - expected).max()))
+            agree += int((actual.argmax(1) == expected.argmax(1)).sum())
+
+    print(f"  → パリティ ({model_json['format']}): "
+          f"max|Δp|={max_diff:.2e}, top1一致={agree}/{len(X_val)}")
+    if max_diff > PARITY_TOL:
+        raise RuntimeError(
+            f"エクスポートしたモデルの出力が PyTorch と一致しません (max|Δp|={max_diff:.2e})"
+        )
+
+
 # ============================================
 # メイン
 # ============================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Quick Draw CNN 学習 (PyTorch)")
+    parser.add_argument("--no-fold", dest="fold_input", action="store_false",
+                        help="入力正規化・反転を conv2d_1 に畳み込まない")
+    parser.add_argument("--graph-model", action="store_true",
+                        help="TF.js graph-model 形式で出力する")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="再現モード: 乱数シードを固定し決定的カーネルを使う")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="DataLoader のワーカー数")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    reproducible = args.seed is not None
+    if reproducible:
+        enable_reproducibility(args.seed)
+
     print(f"\n=== Quick Draw CNN 学習 (PyTorch) ===")
     print(f"カテゴリ数: {NUM_CLASSES}")
-    print(f"サンプル/クラス: {SAMPLES_PER_CLASS}\n")
+    print(f"サンプル/クラス: {SAMPLES_PER_CLASS}")
+    print(f"再現モード: {'seed=' + str(args.seed) if reproducible else 'off'}\n")
 
     # 1. データ読み込み
     print("1. データ読み込み中...")
-    all_images = []
-    all_labels = []
-
-    for i, cat in enumerate(CATEGORIES):
-        data = load_npy(cat["en"], SAMPLES_PER_CLASS)
-        n = len(data)
-        all_images.append(data)
-        all_labels.extend([i] * n)
-        print(f"  {cat['ja']} ({cat['en']}): {n} samples")
-
-    X = np.vstack(all_images).astype(np.float32) / 255.0
-    y = np.array(all_labels, dtype=np.int64)
+    X, y = load_dataset(SAMPLES_PER_CLASS)
     print(f"\n合計: {len(X)} samples")
 
     # 2. Train/Val 分割
@@ -338,21 +915,26 @@ def main():
 
     # データ拡張
     print("データ拡張中...")
-    X_train_aug = augment_batch(X_train)
+    aug_rng = np.random.default_rng(args.seed)
+    X_train_aug = augment_batch(X_train, rng=aug_rng)
     X_train = np.concatenate([X_train, X_train_aug])
     y_train = np.concatenate([y_train, y_train])
     print(f"拡張後 Train: {len(X_train)}")
 
     # 3. PyTorch Dataset
-    X_train_t = torch.tensor(X_train.reshape(-1, 1, IMG_SIZE, IMG_SIZE))
-    y_train_t = torch.tensor(y_train)
-    X_val_t = torch.tensor(X_val.reshape(-1, 1, IMG_SIZE, IMG_SIZE))
-    y_val_t = torch.tensor(y_val)
+    train_loader, val_loader = build_loaders(
+        X_train, y_train, X_val, y_val, seed=args.seed, workers=args.workers
+    )
 
-    train_ds = TensorDataset(X_train_t, y_train_t)
-    val_ds = TensorDataset(X_val_t, y_val_t)
-    train_loader = DataLoader(train_ds, batch_size=BATCH_SIZE, shuffle=True)
-    val_loader = DataLoader(val_ds, batch_size=BATCH_SIZE)
+    determinism_cost = None
+    if reproducible:
+        print(f"決定的カーネルのコスト計測中... "
+              f"({DETERMINISM_BENCH_BATCHES} batches x {DETERMINISM_BENCH_ROUNDS} rounds)")
+        X_train_t, y_train_t, _ = train_loader.dataset.tensors
+        determinism_cost = measure_determinism_cost(X_train_t, y_train_t, args.seed)
+        print(f"  非決定的: {determinism_cost['nondeterministicSamplesPerSec']:.0f} samples/s, "
+              f"決定的: {determinism_cost['deterministicSamplesPerSec']:.0f} samples/s "
+              f"(x{determinism_cost['slowdown']:.2f})")
 
     # 4. モデル
     model = QuickDrawCNN(NUM_CLASSES)
@@ -368,37 +950,22 @@ def main():
     best_state = None
     patience = 5
     no_improve = 0
+    data_order = hashlib.sha256()
+    train_seconds = 0.0
+    train_samples = 0
 
     for epoch in range(EPOCHS):
         # Train
-        model.train()
-        train_loss = 0
-        train_correct = 0
-        train_total = 0
-
-        for batch_x, batch_y in train_loader:
-            optimizer.zero_grad()
-            out = model(batch_x)
-            loss = criterion(out, batch_y)
-            loss.backward()
-            optimizer.step()
-
-            train_loss += loss.item() * len(batch_x)
-            train_correct += (out.argmax(1) == batch_y).sum().item()
-            train_total += len(batch_x)
+        epoch_start = time.perf_counter()
+        _, train_correct, train_total = train_one_epoch(
+            model, train_loader, criterion, optimizer, data_order
+        )
+        epoch_seconds = time.perf_counter() - epoch_start
+        train_seconds += epoch_seconds
+        train_samples += train_total
 
         # Validate
-        model.eval()
-        val_correct = 0
-        val_total = 0
-        val_loss = 0
-        with torch.no_grad():
-            for batch_x, batch_y in val_loader:
-                out = model(batch_x)
-                loss = criterion(out, batch_y)
-                val_loss += loss.item() * len(batch_x)
-                val_correct += (out.argmax(1) == batch_y).sum().item()
-                val_total += len(batch_x)
+        val_loss, val_correct, val_total = evaluate(model, val_loader, criterion)
 
         train_acc = train_correct / train_total
         val_acc = val_correct / val_total
@@ -407,7 +974,7 @@ def main():
 
         print(f"  Epoch {epoch+1:2d}/{EPOCHS}: "
               f"train_acc={train_acc:.4f} val_acc={val_acc:.4f} "
-              f"lr={lr:.6f}")
+              f"lr={lr:.6f} ({train_total / epoch_seconds:.0f} samples/s)")
 
         if val_acc > best_val_acc:
             best_val_acc = val_acc
@@ -428,8 +995,24 @@ def main():
     print("\n3. TF.js形式で保存中...")
     OUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    weight_data, weight_specs = pytorch_to_tfjs_weights(model)
-    model_json = build_tfjs_model_json(weight_specs)
+    weight_data, weight_specs = pytorch_to_tfjs_weights(
+        model, fold_input=args.fold_input, graph_model=args.graph_model
+    )
+    training_info = {
+        "seed": args.seed,
+        "deterministic": reproducible,
+        "dataOrderSha256": data_order.hexdigest(),
+        "weightsSha256": hashlib.sha256(weight_data).hexdigest(),
+    }
+    if args.graph_model:
+        model_json = build_tfjs_graph_model_json(
+            weight_specs, fold_input=args.fold_input, training_info=training_info
+        )
+    else:
+        model_json = build_tfjs_model_json(
+            weight_specs, fold_input=args.fold_input, training_info=training_info
+        )
+    verify_tfjs_parity(model, model_json, weight_data, X_val)
 
     with open(OUT_DIR / "model.json", "w") as f:
         json.dump(model_json, f)
@@ -446,6 +1029,15 @@ def main():
     print(f"  → model.json: {model_size/1024:.1f}KB")
     print(f"  → weights.bin: {weights_size/1024:.1f}KB")
     print(f"  → labels.json")
+    print(f"  → データ順: {training_info['dataOrderSha256'][:16]}")
+    print(f"  → weights.bin sha256: {training_info['weightsSha256'][:16]}")
+
+    # 実行時間は実行ごとに変わるので model.json には書かず表示のみ
+    print(f"\n学習スループット: {train_samples / train_seconds:.0f} samples/s")
+    if determinism_cost is not None:
+        print(f"決定的カーネルのコスト: x{determinism_cost['slowdown']:.2f} "
+              f"({determinism_cost['nondeterministicSamplesPerSec']:.0f} → "
+              f"{determinism_cost['deterministicSamplesPerSec']:.0f} samples/s)")
 
     print(f"\n=== 完了 (val_acc={best_val_acc:.4f}) ===\n")
 
@@ -64,10 +64,10 @@ DATA_DIR = BASE_DIR / "data"
 OUT_DIR = BASE_DIR / "tfjs"
 
 
-def load_npy(category_en, max_samples):
+def load_npy(category_en, max_samples, data_dir=DATA_DIR):
     """Quick Draw .npy ファイルを読み込む"""
     filename = category_en.replace(" ", "_") + ".npy"
-    filepath = DATA_DIR / filename
+    filepath = Path(data_dir) / filename
     if not filepath.exists():
         raise FileNotFoundError(
             f"{filepath} が見つかりません。先に node train.mjs を実行してデータをダウンロードしてください。"
@@ -76,6 +76,43 @@ def load_npy(category_en, max_samples):
     return data[:max_samples]
 
 
+def load_dataset(max_samples, data_dir=DATA_DIR, verbose=True):
+    """全カテゴリを読み込み、正規化済み画像 X [N, 784] とラベル y を返す"""
+    all_images = []
+    all_labels = []
+
+    for i, cat in enumerate(CATEGORIES):
+        data = load_npy(cat["en"], max_samples, data_dir)
+        n = len(data)
+        all_images.append(data)
+        all_labels.extend([i] * n)
+        if verbose:
+            print(f"  {cat['ja']} ({cat['en']}): {n} samples")
+
+    X = np.vstack(all_images).astype(np.float32) / 255.0
+    y = np.array(all_labels)
+    return X, y
+
+
+def build_mlp(max_iter=30, verbose=True):
+    """Dense(256) → Dense(128) の MLPClassifier"""
+    from sklearn.neural_network import MLPClassifier
+
+    return MLPClassifier(
+        hidden_layer_sizes=(256, 128),
+        activation="relu",
+        solver="adam",
+        batch_size=128,
+        learning_rate_init=0.001,
+        max_iter=max_iter,
+        early_stopping=True,
+        validation_fraction=0.1,
+        n_iter_no_change=5,
+        verbose=verbose,
+        random_state=42,
+    )
+
+
 def build_tfjs_model_json(weights_specs):
     """TF.js layers-model 形式の model.json を構築"""
     # Dense(256, relu) → Dense(128, relu) → Dense(NUM_CLASSES, softmax)
@@ -169,7 +206,6 @@ def sklearn_to_tfjs_weights(mlp):
 
 
 def main():
-    from sklearn.neural_network import MLPClassifier
     from sklearn.model_selection import train_test_split
 
     print(f"\n=== Quick Draw MLP 学習 (scikit-learn) ===")
@@ -178,18 +214,7 @@ def main():
 
     # 1. データ読み込み
     print("1. データ読み込み中...")
-    all_images = []
-    all_labels = []
-
-    for i, cat in enumerate(CATEGORIES):
-        data = load_npy(cat["en"], SAMPLES_PER_CLASS)
-        n = len(data)
-        all_images.append(data)
-        all_labels.extend([i] * n)
-        print(f"  {cat['ja']} ({cat['en']}): {n} samples")
-
-    X = np.vstack(all_images).astype(np.float32) / 255.0
-    y = np.array(all_labels)
+    X, y = load_dataset(SAMPLES_PER_CLASS)
 
     print(f"\n合計: {len(X)} samples")
 
@@ -201,19 +226,7 @@ def main():
 
     # 3. 学習
     print("\n2. MLP学習開始...")
-    mlp = MLPClassifier(
-        hidden_layer_sizes=(256, 128),
-        activation="relu",
-        solver="adam",
-        batch_size=128,
-        learning_rate_init=0.001,
-        max_iter=30,
-        early_stopping=True,
-        validation_fraction=0.1,
-        n_iter_no_change=5,
-        verbose=True,
-        random_state=42,
-    )
+    mlp = build_mlp()
     mlp.fit(X_train, y_train)
 
     # 4. 評価